@@ -1,20 +1,47 @@
 import os
+
+# Allocator settings must be in place before torch is imported
+os.environ.setdefault(
+    "PYTORCH_CUDA_ALLOC_CONF",
+    "expandable_segments:True,max_split_size_mb:512,garbage_collection_threshold:0.8"
+)
+
 import time
 import uuid
-import tempfile
-import requests
+import io
+import aiohttp
+import aiofiles
 import logging
 import asyncio
 import json
 import sys
+import hashlib
+import sqlite3
+import math
+import random
+import re
+import threading
+import concurrent.futures
+import contextlib
+from collections import OrderedDict
+import numpy as np
 from PIL import Image
 import torch
+import torchvision.transforms.functional as TF
 import runpod
+import imageio
+from imageio_ffmpeg import get_ffmpeg_exe
+
+try:
+    import PyNvVideoCodec as nvc
+except ImportError:
+    nvc = None
 
 # Import Wan 2.1 components
 import wan
 from wan.configs import WAN_CONFIGS, MAX_AREA_CONFIGS
-from wan.utils.utils import cache_video
+from wan.utils.fm_solvers import FlowDPMSolverMultistepScheduler, get_sampling_sigmas, retrieve_timesteps
+from wan.utils.fm_solvers_unipc import FlowUniPCMultistepScheduler
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -23,43 +50,490 @@ logger = logging.getLogger(__name__)
 # Global model cache
 model_cache = {}
 
-def download_image(url, timeout=30):
-    """Download image from URL and return PIL Image"""
+# GPUs with less VRAM than this keep Wan's CPU<->GPU weight offloading enabled
+OFFLOAD_THRESHOLD_GB = float(os.environ.get('OFFLOAD_THRESHOLD_GB', 40))
+
+# Keep freed blocks in the caching allocator instead of letting Wan call empty_cache()
+KEEP_CUDA_CACHE = os.environ.get('KEEP_CUDA_CACHE', '1') == '1'
+
+# Supported output resolutions - EXACT size/shift pairs from generate.py logic
+RESOLUTIONS = {
+    "720p": {"size_key": "1280*720", "shift": 8.0},
+    "480p": {"size_key": "832*480", "shift": 8.0},
+}
+
+# Number of T5 prompt embeddings kept on the GPU (the default negative prompt is pinned)
+TEXT_CACHE_SIZE = int(os.environ.get('TEXT_CACHE_SIZE', 128))
+
+# Sampling defaults: dpm++ reaches UniPC-40 quality in ~25 steps
+DEFAULT_SAMPLING_STEPS = 25
+DEFAULT_SOLVER = "dpm++"
+SAMPLE_SOLVERS = ("unipc", "dpm++")
+MIN_SAMPLING_STEPS = 4
+MAX_SAMPLING_STEPS = 50
+
+# torch.compile the DiT and persist compiled kernels per resolution across workers
+COMPILE_MODEL = os.environ.get('COMPILE_MODEL', '1') == '1'
+COMPILE_CACHE_DIR = os.environ.get('COMPILE_CACHE_DIR', '/workspace')
+
+# Concurrent jobs are collected for up to BATCH_TIMEOUT seconds and run as one diffusion batch
+BATCH_MAX = int(os.environ.get('BATCH_MAX', 4))
+BATCH_TIMEOUT = float(os.environ.get('BATCH_TIMEOUT', 0.05))
+
+# VRAM kept free for VAE encode/decode and CUDA graph pools when sizing batches
+VRAM_RESERVE_GB = float(os.environ.get('VRAM_RESERVE_GB', 10))
+job_queue = None
+batcher_task = None
+
+# All GPU work runs on one thread: CUDA graph trees keep per-thread state, so graphs
+# captured during warmup are only replayed from the thread that captured them
+gpu_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="gpu")
+
+# Result cache: maps (image, prompt, params) to a previously uploaded video URL
+CACHE_DB_PATH = os.environ.get('CACHE_DB_PATH', '/workspace/cache.db')
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 10000))
+CACHE_TTL_SECONDS = int(os.environ.get('CACHE_TTL_SECONDS', 24 * 3600))  # Match hosted URL expiry
+cache_db = None
+cache_lock = threading.Lock()  # Lookups and stores run in worker threads
+
+# Error classification: exception types first, then keywords in the message
+ERROR_TYPES = (
+    (torch.cuda.OutOfMemoryError, "MEMORY_ERROR"),
+    (aiohttp.ClientError, "UPLOAD_ERROR"),  # download errors are re-raised as RuntimeError
+)
+ERROR_PATTERN = re.compile(r"(download|model|memory|cuda|upload)", re.I)
+ERROR_CODES = {
+    "download": "DOWNLOAD_ERROR",
+    "model": "MODEL_ERROR",
+    "memory": "MEMORY_ERROR",
+    "cuda": "MEMORY_ERROR",
+    "upload": "UPLOAD_ERROR",
+}
+
+# Shared HTTP session, created lazily inside the worker's event loop
+http_session = None
+HTTP_USER_AGENT = 'Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.120 Mobile Safari/537.36'
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.2
+UPLOAD_CHUNK_SIZE = 1 << 20
+UPLOAD_HEARTBEAT_SECONDS = 5
+
+# Upload NVENC output while it is still encoding. Off by default: this needs chunked
+# transfer encoding, and catbox.moe acceptance of chunked uploads is unverified
+STREAM_UPLOAD = os.environ.get('STREAM_UPLOAD', '0') == '1'
+
+def _get_http_session():
+    """Return the shared aiohttp session, creating it on first use"""
+    global http_session
+    
+    if http_session is None or http_session.closed:
+        # Pooled keep-alive connections skip the TCP/TLS handshake on every job
+        http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=64, limit_per_host=16, keepalive_timeout=60),
+            headers={'User-Agent': HTTP_USER_AGENT, 'Connection': 'keep-alive'}
+        )
+    
+    return http_session
+
+def decode_image(content, max_area):
+    """Decode image bytes to an RGB PIL Image downscaled for max_area"""
+    # Wan resizes to max_area anyway; keep 2x headroom for its own resize
+    target = math.isqrt(max_area) * 2
+    
+    # Decode straight from memory; draft() lets JPEGs decode at reduced scale,
+    # and convert() fully loads the pixels so the buffer can be freed
+    image = Image.open(io.BytesIO(content))
+    image.draft("RGB", (target, target))
+    image = image.convert("RGB")
+    image.thumbnail((target, target), Image.LANCZOS)
+    return image
+
+async def download_image(url, max_area, timeout=30):
+    """Download image from URL and return PIL Image (downscaled for max_area) along with the raw bytes"""
     try:
         logger.info(f"Downloading image from: {url}")
-        response = requests.get(url, timeout=timeout)
-        response.raise_for_status()
-        
-        # Save to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-            tmp_file.write(response.content)
-            tmp_path = tmp_file.name
+        session = _get_http_session()
+        for attempt in range(HTTP_RETRIES + 1):
+            try:
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                    response.raise_for_status()
+                    content = await response.read()
+                break
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                # Retry transient connection failures, not HTTP error statuses
+                if attempt == HTTP_RETRIES:
+                    raise
+                await asyncio.sleep(HTTP_BACKOFF * 2 ** attempt)
         
-        # Open as PIL Image
-        image = Image.open(tmp_path).convert("RGB")
-        os.unlink(tmp_path)  # Clean up temp file
+        # Decoding and resizing a large upload would stall every other job on this loop
+        image = await asyncio.to_thread(decode_image, content, max_area)
         
         logger.info(f"Successfully downloaded image: {image.size}")
-        return image
+        return image, content
         
     except Exception as e:
         logger.error(f"Failed to download image: {str(e)}")
         raise RuntimeError(f"Failed to download image from {url}: {str(e)}")
 
-def _upload(path):
-    """Upload video to catbox.moe"""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.120 Mobile Safari/537.36'
-    }
+async def _post_video(payload, filename):
+    """POST an MP4 payload to catbox.moe and return the hosted URL"""
+    with aiohttp.MultipartWriter("form-data") as form:
+        part = form.append("fileupload")
+        part.set_content_disposition("form-data", name="reqtype")
+        part = form.append_payload(payload)
+        part.set_content_disposition("form-data", name="fileToUpload", filename=filename)
+    
+    session = _get_http_session()
+    async with session.post("https://catbox.moe/user/api.php",
+                            data=form,
+                            timeout=aiohttp.ClientTimeout(total=60)) as r:
+        r.raise_for_status()
+        return (await r.text()).strip()
+
+async def _upload_stream(chunks, filename):
+    """Upload an async iterable of MP4 bytes to catbox.moe with chunked transfer encoding"""
+    return await _post_video(
+        aiohttp.payload.AsyncIterablePayload(chunks, content_type="video/mp4"), filename)
+
+async def _upload(path):
+    """Upload video to catbox.moe and remove the local file"""
+    # A file payload has a known size, so the request carries a Content-Length; aiohttp
+    # reads it in executor threads instead of holding the whole video in memory
+    try:
+        with open(path, "rb") as f:
+            return await _post_video(
+                aiohttp.payload.BufferedReaderPayload(f, content_type="video/mp4"),
+                os.path.basename(path))
+    finally:
+        await asyncio.to_thread(os.unlink, path)
+
+def open_cache_db(path=CACHE_DB_PATH):
+    """Open the result cache database, creating the table and eviction trigger"""
+    global cache_db
+    
+    try:
+        db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS cache "
+            "(key TEXT PRIMARY KEY, url TEXT, created_at INTEGER, last_used INTEGER)"
+        )
+        # Evict least recently used rows once the table grows past CACHE_MAX_ENTRIES
+        db.execute("DROP TRIGGER IF EXISTS cache_evict")
+        db.execute(f"""
+            CREATE TRIGGER cache_evict AFTER INSERT ON cache
+            WHEN (SELECT COUNT(*) FROM cache) > {CACHE_MAX_ENTRIES}
+            BEGIN
+                DELETE FROM cache WHERE key IN (
+                    SELECT key FROM cache ORDER BY last_used
+                    LIMIT (SELECT COUNT(*) FROM cache) - {CACHE_MAX_ENTRIES}
+                );
+            END
+        """)
+        cache_db = db
+        logger.info(f"Result cache opened at: {path}")
+    except sqlite3.Error as e:
+        logger.warning(f"Result cache disabled, failed to open {path}: {str(e)}")
+
+def _cache_key(image_bytes, prompt, negative, seed, resolution, sampling_steps, sample_solver):
+    """Content-addressed key for a generation request"""
+    h = hashlib.sha256(image_bytes)
+    h.update(json.dumps([prompt, negative, seed, resolution, sampling_steps, sample_solver]).encode())
+    return h.hexdigest()
+
+def cache_lookup(key):
+    """Return the cached video URL for key, or None on a miss, expired entry or database error"""
+    now = int(time.time())
+    try:
+        with cache_lock:
+            row = cache_db.execute(
+                "SELECT url FROM cache WHERE key=? AND created_at>?",
+                (key, now - CACHE_TTL_SECONDS)
+            ).fetchone()
+            if row is None:
+                return None
+            
+            cache_db.execute("UPDATE cache SET last_used=? WHERE key=?", (now, key))
+            return row[0]
+    except sqlite3.Error as e:
+        logger.warning(f"Result cache lookup failed: {str(e)}")
+        return None
+
+def cache_store(key, url):
+    """Record the uploaded video URL for key; failures are logged, never raised"""
+    now = int(time.time())
+    try:
+        with cache_lock:
+            cache_db.execute(
+                "INSERT OR REPLACE INTO cache (key, url, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, url, now, now)
+            )
+    except sqlite3.Error as e:
+        logger.warning(f"Result cache store failed: {str(e)}")
+
+def _rgb_to_nv12(frame):
+    """Convert a (3, H, W) RGB frame in [0, 255] to an (H*3/2, W) NV12 uint8 buffer (BT.601)"""
+    r, g, b = frame
+    y = 0.257 * r + 0.504 * g + 0.098 * b + 16
+    u = -0.148 * r - 0.291 * g + 0.439 * b + 128
+    v = 0.439 * r - 0.368 * g - 0.071 * b + 128
+    
+    # 4:2:0 chroma subsampling, then interleave U/V into a single plane
+    uv = torch.nn.functional.avg_pool2d(torch.stack([u, v])[None], 2)[0]
+    uv = uv.permute(1, 2, 0).reshape(uv.shape[1], -1)
+    return torch.cat([y, uv]).round_().clamp_(0, 255).to(torch.uint8).contiguous()
+
+def probe_nvenc():
+    """Encode one tiny frame to check the GPU actually has NVENC (A100/H100 do not)"""
+    if nvc is None or not torch.cuda.is_available():
+        return False
+    
+    try:
+        encoder = nvc.CreateEncoder(256, 256, "NV12", False, codec="h264", fps=18)
+        encoder.Encode(_rgb_to_nv12(torch.zeros(3, 256, 256, device="cuda")))
+        encoder.EndEncode()
+        return True
+    except Exception as e:
+        logger.info(f"NVENC unavailable, using libx264: {str(e)}")
+        return False
+
+def _nvenc_available(video):
+    """Whether the video can go through the NVENC encoder"""
+    return model_cache.get('nvenc', False) and video.is_cuda
+
+async def stream_video_nvenc(video, fps):
+    """Encode a (C, F, H, W) CUDA video tensor in [-1, 1] with NVENC, yielding fragmented MP4 chunks"""
+    _, _, height, width = video.shape
+    video = video.clamp(-1, 1).add_(1).mul_(127.5)
+    
+    # Frames stay on the GPU all the way into the hardware encoder
+    encoder = nvc.CreateEncoder(width, height, "NV12", False, codec="h264", fps=fps)
+    
+    # Mux the raw H.264 stream without re-encoding; a fragmented MP4 can be
+    # written to a pipe and sent before the last frame is encoded
+    proc = await asyncio.create_subprocess_exec(
+        get_ffmpeg_exe(), "-loglevel", "error",
+        "-f", "h264", "-framerate", str(fps), "-i", "-",
+        "-c", "copy",
+        "-movflags", "empty_moov+default_base_moof", "-frag_duration", "1000000",
+        "-f", "mp4", "-",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE
+    )
+    
+    def encode_frame(frame):
+        return encoder.Encode(_rgb_to_nv12(frame))
+    
+    async def feed():
+        try:
+            for frame in video.unbind(1):
+                proc.stdin.write(await asyncio.to_thread(encode_frame, frame))
+                await proc.stdin.drain()
+            proc.stdin.write(encoder.EndEncode())
+            await proc.stdin.drain()
+        finally:
+            proc.stdin.close()
+    
+    feeder = asyncio.create_task(feed())
+    try:
+        while chunk := await proc.stdout.read(UPLOAD_CHUNK_SIZE):
+            yield chunk
+        await feeder
+        if await proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg muxing failed with exit code {proc.returncode}")
+    finally:
+        feeder.cancel()
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+async def _encode_to_file(video, path, fps, queue=None):
+    """Write NVENC output to path, optionally handing each chunk to queue; ends with None or the error"""
+    try:
+        async with contextlib.aclosing(stream_video_nvenc(video, fps)) as chunks:
+            async with aiofiles.open(path, "wb") as f:
+                async for chunk in chunks:
+                    await f.write(chunk)
+                    if queue is not None:
+                        queue.put_nowait(chunk)
+    except BaseException as e:
+        if queue is not None:
+            queue.put_nowait(e)
+        raise
+    if queue is not None:
+        queue.put_nowait(None)
+
+async def _iter_queue(queue):
+    """Yield chunks from _encode_to_file until it finishes"""
+    while (chunk := await queue.get()) is not None:
+        if isinstance(chunk, BaseException):
+            raise RuntimeError("NVENC encoding failed") from chunk
+        yield chunk
+
+def write_video_cpu(video, path, fps):
+    """Encode a (C, F, H, W) video tensor in [-1, 1] with libx264, matching cache_video output"""
+    # Normalize where the tensor lives (GPU) and copy only uint8 frames to the host
+    frames = ((video.clamp(-1, 1) + 1) * 127.5).to(torch.uint8)
+    frames = frames.permute(1, 2, 3, 0).contiguous().cpu()
+    
+    # Same writer settings as cache_video in wan.utils.utils
+    writer = imageio.get_writer(path, fps=fps, codec='libx264', quality=8)
+    for frame in frames.numpy():
+        writer.append_data(frame)
+    writer.close()
+    return path
+
+async def save_video(video, path, fps):
+    """Encode the video to path with NVENC when available, falling back to libx264"""
+    if _nvenc_available(video):
+        try:
+            await _encode_to_file(video, path, fps)
+            return path
+        except Exception as e:
+            logger.warning(f"NVENC encoding failed, falling back to libx264: {str(e)}")
+    
+    return await asyncio.to_thread(write_video_cpu, video, path, fps)
+
+async def upload_video_streaming(video, path, fps):
+    """Encode with NVENC and upload the MP4 while it is still being encoded.
+
+    Encoding runs as its own task that also writes the MP4 to path, so a
+    failed upload only waits for encoding to finish and retries from the
+    file; the video is re-encoded with libx264 only if NVENC itself fails.
+    """
+    queue = asyncio.Queue()
+    encode_task = asyncio.create_task(_encode_to_file(video, path, fps, queue))
+    
+    try:
+        try:
+            video_url = await _upload_stream(_iter_queue(queue), os.path.basename(path))
+        except Exception as e:
+            upload_error = e
+        else:
+            await encode_task
+            await asyncio.to_thread(os.unlink, path)
+            return video_url
+        
+        try:
+            await encode_task
+        except Exception as e:
+            # The file is partial; encode a fresh copy next to it
+            logger.warning(f"NVENC encoding failed, falling back to libx264: {str(e)}")
+            if os.path.exists(path):
+                await asyncio.to_thread(os.unlink, path)
+            fallback_path = path.replace(".mp4", "_x264.mp4")
+            await asyncio.to_thread(write_video_cpu, video, fallback_path, fps)
+            return await _upload(fallback_path)
+        
+        logger.warning(f"Streaming upload failed, retrying from file: {str(upload_error)}")
+        return await _upload(path)
+    finally:
+        # Stops NVENC and ffmpeg if the job itself is cancelled
+        encode_task.cancel()
+
+def compile_dit(dit):
+    """Compile the DiT with CUDA graphs for a fixed input shape"""
+    # Every (resolution, orientation, batch size) is its own static-shape graph of the
+    # same forward; keep Dynamo from falling back to eager once they are all warmed up
+    shapes = len(RESOLUTIONS) * 2 * BATCH_MAX
+    for limit in ("recompile_limit", "cache_size_limit"):
+        if hasattr(torch._dynamo.config, limit):
+            setattr(torch._dynamo.config, limit, max(getattr(torch._dynamo.config, limit), shapes))
+    
+    compiled = torch.compile(dit, mode="reduce-overhead", dynamic=False)
+    compiled_forward = compiled.forward
     
-    with open(path, "rb") as f:
-        r = requests.post("https://catbox.moe/user/api.php", 
-                        files={"fileToUpload": f},
-                        data={"reqtype": "fileupload"},
-                        headers=headers,
-                        timeout=60)
-    r.raise_for_status()
-    return r.text.strip()
+    # CUDA graph outputs are overwritten on the next replay, and Wan keeps the
+    # conditional prediction alive across the unconditional call, so return copies
+    def forward(*args, **kwargs):
+        return [u.clone() for u in compiled_forward(*args, **kwargs)]
+    
+    compiled.forward = forward
+    return compiled
+
+def _compile_cache_path(resolution):
+    """Mega-Cache file for a resolution; shapes differ so each gets its own file"""
+    return os.path.join(COMPILE_CACHE_DIR, f"compile_cache_{resolution}_b{BATCH_MAX}.bin")
+
+def load_compile_cache():
+    """Load previously saved Inductor artifacts so compilation becomes a cache hit"""
+    if not hasattr(torch.compiler, "load_cache_artifacts"):
+        return
+    
+    for resolution in RESOLUTIONS:
+        path = _compile_cache_path(resolution)
+        if not os.path.exists(path):
+            continue
+        try:
+            with open(path, "rb") as f:
+                torch.compiler.load_cache_artifacts(f.read())
+            logger.info(f"Loaded compile cache: {path}")
+        except Exception as e:
+            logger.warning(f"Failed to load compile cache {path}: {str(e)}")
+
+def save_compile_cache(resolution):
+    """Persist compiled artifacts after the first generation at this resolution"""
+    path = _compile_cache_path(resolution)
+    if not hasattr(torch.compiler, "save_cache_artifacts") or os.path.exists(path):
+        return
+    
+    try:
+        artifacts = torch.compiler.save_cache_artifacts()
+        if artifacts is None:
+            return
+        
+        # Write then rename so workers sharing the volume never read a partial file
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(artifacts[0])
+        os.replace(tmp_path, path)
+        logger.info(f"Saved compile cache: {path}")
+    except Exception as e:
+        logger.warning(f"Failed to save compile cache {path}: {str(e)}")
+
+class CachedTextEncoder:
+    """Wraps Wan's T5EncoderModel with an LRU cache of prompt embeddings.
+
+    Wan calls ``text_encoder(texts, device)`` and moves ``text_encoder.model``
+    around directly, so everything except ``__call__`` is forwarded unchanged.
+    Embeddings stay on the device they were computed on to avoid H2D copies.
+    """
+    
+    def __init__(self, encoder, max_entries=TEXT_CACHE_SIZE):
+        self.encoder = encoder
+        self.max_entries = max_entries
+        self.cache = OrderedDict()
+        self.pinned = set()
+    
+    def __getattr__(self, name):
+        return getattr(self.encoder, name)
+    
+    def __call__(self, texts, device):
+        keys = [hashlib.blake2b(text.encode()).hexdigest() for text in texts]
+        
+        # Encode all misses in a single T5 forward
+        missing = {k: text for k, text in zip(keys, texts) if k not in self.cache}
+        if missing:
+            # T5 returns views into its padded batch output; clone so that buffer can be freed
+            for k, emb in zip(missing, self.encoder(list(missing.values()), device)):
+                self.cache[k] = emb.clone()
+        
+        # Mark this call's keys as recent and collect results before evicting anything
+        for k in keys:
+            self.cache.move_to_end(k)
+        embs = [self.cache[k].to(device) for k in keys]
+        self._evict()
+        return embs
+    
+    def pin(self, text, device):
+        """Encode text now and never evict it"""
+        self.encoder.model.to(device)
+        self([text], device)
+        self.pinned.add(hashlib.blake2b(text.encode()).hexdigest())
+    
+    def _evict(self):
+        unpinned = [k for k in self.cache if k not in self.pinned]
+        for k in unpinned[:max(0, len(self.cache) - self.max_entries)]:
+            del self.cache[k]
 
 def load_model():
     """Load and cache the Wan I2V model"""
@@ -88,12 +562,409 @@ def load_model():
             t5_cpu=False,
         )
         
+        # Skip the T5 forward for repeated prompts; the default negative is almost always a hit
+        model.text_encoder = CachedTextEncoder(model.text_encoder)
+        model.text_encoder.pin(cfg.sample_neg_prompt, model.device)
+        
+        model.model.eval().requires_grad_(False)
+        
+        # Wan keeps DiT weights in fp32 and relies on bf16 autocast; storing them in
+        # bf16 halves weight memory traffic (norms still upcast to fp32 internally)
+        model.model.to(dtype=torch.bfloat16)
+        torch.backends.cuda.matmul.allow_bf16_reduced_precision_reduction = True
+        
+        # One compiled DiT per resolution, each specialized to its own static shapes;
+        # CUDA graphs need resident weights, so skip compilation when offloading
+        if COMPILE_MODEL and not model_cache.get('offload', False):
+            for resolution in RESOLUTIONS:
+                model_cache[f'dit_{resolution}'] = compile_dit(model.model)
+        
         model_cache['wan_i2v'] = model
         model_cache['config'] = cfg
         logger.info("Model loaded successfully")
     
     return model_cache['wan_i2v'], model_cache['config']
 
+def warmup_model(model, cfg, offload):
+    """Warm up kernels before the first job.
+
+    A tiny 64x64 generation triggers cuDNN/cuBLAS autotuning. Compiled DiTs
+    are then called directly with placeholder inputs for each canonical size
+    from _canonical_sizes() at every batch size up to model_cache['batch_max'],
+    so compilation (or a compile cache load) and CUDA graph capture happen
+    here, not on a job; T5, CLIP and the VAE stay eager and are not warmed
+    per shape. Only these warmed shapes use the compiled DiT; others run eagerly.
+    Must run on gpu_executor, like generate_videos().
+    """
+    logger.info("Warming up model...")
+    with torch.inference_mode():
+        model.generate(
+            "warmup",
+            Image.new("RGB", (64, 64)),
+            max_area=64 * 64,
+            frame_num=81,              # I2V mask assumes 81 frames
+            shift=8.0,
+            sample_solver='unipc',
+            sampling_steps=2,
+            guide_scale=5.0,
+            n_prompt=cfg.sample_neg_prompt,
+            seed=0,
+            offload_model=offload
+        )
+        
+        if COMPILE_MODEL and not offload:
+            for resolution, params in RESOLUTIONS.items():
+                max_area = MAX_AREA_CONFIGS[params["size_key"]]
+                dit = model_cache[f'dit_{resolution}']
+                for width, height in _canonical_sizes(resolution):
+                    latent_size = _latent_size(model, Image.new("RGB", (width, height)), max_area)
+                    # The batch size is part of the compiled shape
+                    for batch_size in range(1, model_cache['batch_max'] + 1):
+                        x, t, args = _dit_inputs(model, cfg, latent_size, batch_size, params["shift"])
+                        # First call compiles, second captures the CUDA graph jobs replay
+                        _run_dit(model, dit, x, t, args, calls=2)
+                        model_cache['compiled_shapes'].add((resolution, latent_size, batch_size))
+                        logger.info(f"Warmed up {resolution} {width}x{height} batch={batch_size}")
+                save_compile_cache(resolution)
+    logger.info("Model warmup complete")
+
+def init_worker():
+    """Load and warm up the model once per worker, before any job is accepted"""
+    torch.set_grad_enabled(False)
+    torch.backends.cudnn.benchmark = True
+    
+    # Wan empties the CUDA cache between steps when offloading, forcing fresh
+    # cudaMalloc calls; the allocator's GC threshold already bounds cached memory
+    if KEEP_CUDA_CACHE:
+        torch.cuda.empty_cache = lambda: None
+    
+    open_cache_db()
+    model_cache['nvenc'] = probe_nvenc()
+    
+    # Only stream weights over PCIe between steps when the model doesn't fit in VRAM
+    total_mem = torch.cuda.get_device_properties(0).total_memory
+    model_cache['offload'] = total_mem < OFFLOAD_THRESHOLD_GB * 1024**3
+    logger.info(f"GPU memory: {total_mem / 1024**3:.1f} GiB, offload_model={model_cache['offload']}")
+    
+    if COMPILE_MODEL:
+        load_compile_cache()
+    model, cfg = load_model()
+    model_cache['h2d_stream'] = torch.cuda.Stream()
+    model_cache['compiled_shapes'] = set()
+    
+    # Offloading streams weights per step, so batching only adds memory pressure
+    model_cache['batch_max'] = 1 if model_cache['offload'] else gpu_executor.submit(
+        fit_batch_max, model, cfg).result()
+    gpu_executor.submit(warmup_model, model, cfg, model_cache['offload']).result()
+
+def _latent_size(model, image, max_area):
+    """Latent (h, w) for an input image - EXACT formula from WanI2V.generate"""
+    w, h = image.size
+    aspect_ratio = h / w
+    lat_h = round(
+        math.sqrt(max_area * aspect_ratio) // model.vae_stride[1] //
+        model.patch_size[1] * model.patch_size[1])
+    lat_w = round(
+        math.sqrt(max_area / aspect_ratio) // model.vae_stride[2] //
+        model.patch_size[2] * model.patch_size[2])
+    return lat_h, lat_w
+
+def _canonical_sizes(resolution):
+    """(width, height) of the landscape and portrait inputs compiled DiTs are warmed up for"""
+    width, height = (int(x) for x in RESOLUTIONS[resolution]["size_key"].split("*"))
+    return (width, height), (height, width)
+
+def _max_seq_len(model, lat_h, lat_w, frame_num=81):
+    """DiT sequence length for a latent size - EXACT formula from WanI2V.generate"""
+    max_seq_len = ((frame_num - 1) // model.vae_stride[0] + 1) * lat_h * lat_w // (
+        model.patch_size[1] * model.patch_size[2])
+    return int(math.ceil(max_seq_len / model.sp_size)) * model.sp_size
+
+def _pad_context(model, context):
+    """Zero-pad T5 embeddings to text_len, as the DiT does itself.
+
+    Padding before the call keeps prompt length out of the input shapes a
+    compiled DiT specializes on.
+    """
+    text_len = model.model.text_len
+    return [torch.cat([u, u.new_zeros(text_len - u.size(0), u.size(1))]) for u in context]
+
+def _dit_inputs(model, cfg, latent_size, batch_size, shift, frame_num=81):
+    """Placeholder DiT inputs with the shapes and dtypes generate_batched() passes"""
+    device = model.device
+    lat_h, lat_w = latent_size
+    lat_f = (frame_num - 1) // 4 + 1
+    
+    # Separate tensors per request: aliased inputs would compile a different graph
+    x = [torch.zeros(16, lat_f, lat_h, lat_w, device=device) for _ in range(batch_size)]
+    _, timesteps = _make_scheduler(model, DEFAULT_SOLVER, 2, shift)
+    t = torch.stack([timesteps[0]] * batch_size).to(device)
+    clip_fea = model.clip.visual([torch.zeros(3, 1, 224, 224, device=device)])
+    args = {
+        'context': _pad_context(model, model.text_encoder([cfg.sample_neg_prompt] * batch_size, device)),
+        'clip_fea': clip_fea.repeat(batch_size, 1, 1),
+        'seq_len': _max_seq_len(model, lat_h, lat_w, frame_num),
+        'y': [torch.zeros(4 + 16, lat_f, lat_h, lat_w, device=device) for _ in range(batch_size)],
+    }
+    return x, t, args
+
+def _run_dit(model, dit, x, t, args, calls=1):
+    """Call the DiT the way generate_batched() does"""
+    with torch.autocast('cuda', dtype=model.param_dtype), torch.no_grad():
+        for _ in range(calls):
+            dit(x, t=t, **args)
+
+def fit_batch_max(model, cfg):
+    """Largest batch size up to BATCH_MAX whose DiT activations fit in free VRAM"""
+    resolution = max(RESOLUTIONS, key=lambda r: MAX_AREA_CONFIGS[RESOLUTIONS[r]["size_key"]])
+    params = RESOLUTIONS[resolution]
+    width, height = _canonical_sizes(resolution)[0]
+    latent_size = _latent_size(model, Image.new("RGB", (width, height)), MAX_AREA_CONFIGS[params["size_key"]])
+    
+    with torch.inference_mode():
+        x, t, args = _dit_inputs(model, cfg, latent_size, 1, params["shift"])
+        
+        # One eager forward at the largest shape; each extra job in a batch needs about as much again
+        torch.cuda.synchronize()
+        baseline = torch.cuda.memory_allocated()
+        torch.cuda.reset_peak_memory_stats()
+        _run_dit(model, model.model, x, t, args)
+        per_job = torch.cuda.max_memory_allocated() - baseline
+    
+    # Free device memory plus blocks the caching allocator holds but isn't using
+    free, _ = torch.cuda.mem_get_info()
+    free += torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+    free -= VRAM_RESERVE_GB * 1024**3
+    
+    batch_max = max(1, min(BATCH_MAX, int(free // max(per_job, 1))))
+    logger.info(f"DiT activations per job at {resolution}: {per_job / 1024**3:.1f} GiB, batch_max={batch_max}")
+    return batch_max
+
+def _make_scheduler(model, sample_solver, sampling_steps, shift):
+    """Build a sampling scheduler and its timesteps - EXACT setup from WanI2V.generate"""
+    if sample_solver == 'unipc':
+        scheduler = FlowUniPCMultistepScheduler(
+            num_train_timesteps=model.num_train_timesteps,
+            shift=1,
+            use_dynamic_shifting=False)
+        scheduler.set_timesteps(sampling_steps, device=model.device, shift=shift)
+        timesteps = scheduler.timesteps
+    elif sample_solver == 'dpm++':
+        scheduler = FlowDPMSolverMultistepScheduler(
+            num_train_timesteps=model.num_train_timesteps,
+            shift=1,
+            use_dynamic_shifting=False)
+        sampling_sigmas = get_sampling_sigmas(sampling_steps, shift)
+        timesteps, _ = retrieve_timesteps(scheduler, device=model.device, sigmas=sampling_sigmas)
+    else:
+        raise NotImplementedError("Unsupported solver.")
+    return scheduler, timesteps
+
+def stage_image(image):
+    """Start copying a PIL image to the GPU on the side stream, normalized to [-1, 1] (C, H, W).
+
+    Called from a worker thread: the host copies into pinned memory stay off the event loop.
+    """
+    image_cpu = torch.from_numpy(np.asarray(image)).pin_memory()
+    stream = model_cache['h2d_stream']
+    
+    with torch.cuda.stream(stream):
+        image_gpu = image_cpu.to(model_cache['wan_i2v'].device, non_blocking=True)
+        image_gpu = image_gpu.permute(2, 0, 1).float().div_(127.5).sub_(1)
+        ready = torch.cuda.Event()
+        ready.record(stream)
+    
+    return image_gpu, ready
+
+def generate_batched(model, requests, dit=None, frame_num=81, guide_scale=5.0):
+    """Run one or more same-shape I2V requests through one DiT forward per step.
+
+    Mirrors WanI2V.generate with offload_model=False, but passes lists of
+    latents/contexts to the DiT, which pads and stacks them into a batch.
+    Each request keeps its own noise generator and scheduler state, and
+    images already staged on the GPU by stage_image() are used in place.
+    Unlike Wan, the bicubic resize for the VAE input runs on the GPU, so
+    the conditioning frame can differ from Wan's CPU resize by float rounding.
+    ``dit`` overrides ``model.model``, e.g. with a resolution-specific compiled DiT.
+    """
+    device = model.device
+    if dit is None:
+        dit = model.model
+    lat_h, lat_w = requests[0]["latent_size"]
+    shift = requests[0]["shift"]
+    sample_solver = requests[0]["sample_solver"]
+    sampling_steps = requests[0]["sampling_steps"]
+    h = lat_h * model.vae_stride[1]
+    w = lat_w * model.vae_stride[2]
+    
+    max_seq_len = _max_seq_len(model, lat_h, lat_w, frame_num)
+    
+    imgs = []
+    stream = torch.cuda.current_stream()
+    for r in requests:
+        if "image_gpu" in r:
+            stream.wait_event(r["image_ready"])
+            r["image_gpu"].record_stream(stream)
+            imgs.append(r["image_gpu"])
+        else:
+            imgs.append(TF.to_tensor(r["image"]).sub_(0.5).div_(0.5).to(device))
+    
+    generators, latents = [], []
+    for r in requests:
+        seed = r["seed"] if r["seed"] >= 0 else random.randint(0, sys.maxsize)
+        seed_g = torch.Generator(device=device)
+        seed_g.manual_seed(seed)
+        generators.append(seed_g)
+        latents.append(torch.randn(
+            16, (frame_num - 1) // 4 + 1, lat_h, lat_w,
+            dtype=torch.float32, generator=seed_g, device=device))
+    
+    msk = torch.ones(1, 81, lat_h, lat_w, device=device)
+    msk[:, 1:] = 0
+    msk = torch.concat([torch.repeat_interleave(msk[:, 0:1], repeats=4, dim=1), msk[:, 1:]], dim=1)
+    msk = msk.view(1, msk.shape[1] // 4, 4, lat_h, lat_w)
+    msk = msk.transpose(1, 2)[0]
+    
+    # Text, CLIP and VAE conditioning for the whole batch
+    model.text_encoder.model.to(device)
+    context = model.text_encoder([r["prompt"] for r in requests], device)
+    context_null = model.text_encoder([r["n_prompt"] for r in requests], device)
+    context, context_null = _pad_context(model, context), _pad_context(model, context_null)
+    
+    model.clip.model.to(device)
+    clip_context = model.clip.visual([img[:, None, :, :] for img in imgs])
+    
+    # Resize where the image already is instead of round-tripping through the host
+    ys = model.vae.encode([
+        torch.concat([
+            torch.nn.functional.interpolate(
+                img[None], size=(h, w), mode='bicubic').transpose(0, 1),
+            torch.zeros(3, frame_num - 1, h, w, device=device)
+        ], dim=1)
+        for img in imgs
+    ])
+    ys = [torch.concat([msk, y]) for y in ys]
+    
+    with torch.autocast('cuda', dtype=model.param_dtype), torch.no_grad():
+        schedulers = []
+        for _ in requests:
+            scheduler, timesteps = _make_scheduler(model, sample_solver, sampling_steps, shift)
+            schedulers.append(scheduler)
+        
+        arg_c = {'context': context, 'clip_fea': clip_context, 'seq_len': max_seq_len, 'y': ys}
+        arg_null = {'context': context_null, 'clip_fea': clip_context, 'seq_len': max_seq_len, 'y': ys}
+        
+        dit.to(device)
+        for t in timesteps:
+            timestep = torch.stack([t] * len(requests)).to(device)
+            noise_pred_cond = dit(latents, t=timestep, **arg_c)
+            noise_pred_uncond = dit(latents, t=timestep, **arg_null)
+            
+            latents = [
+                scheduler.step(
+                    (uncond + guide_scale * (cond - uncond)).unsqueeze(0),
+                    t,
+                    latent.unsqueeze(0),
+                    return_dict=False,
+                    generator=seed_g)[0].squeeze(0)
+                for scheduler, cond, uncond, latent, seed_g in zip(
+                    schedulers, noise_pred_cond, noise_pred_uncond, latents, generators)
+            ]
+        
+        videos = model.vae.decode(latents)
+    
+    return videos
+
+def generate_videos(requests):
+    """Generate one video per request; requests must share resolution and latent size"""
+    model = model_cache['wan_i2v']
+    offload = model_cache['offload']
+    
+    # Grad mode is thread-local, so disable autograd bookkeeping here in the worker thread
+    with torch.inference_mode():
+        if not offload:
+            logger.info(f"Generating {len(requests)} video(s)...")
+            # Any other shape would compile and capture a new CUDA graph mid-job, so run it eagerly
+            resolution = requests[0]["resolution"]
+            shape = (resolution, requests[0]["latent_size"], len(requests))
+            dit = model_cache[f"dit_{resolution}"] if shape in model_cache['compiled_shapes'] else None
+            videos = generate_batched(model, requests, dit=dit)
+        else:
+            # Offloading runs one job at a time through Wan's own pipeline
+            r = requests[0]
+            logger.info("Generating video...")
+            # EXACT method call from generate.py
+            videos = [model.generate(
+                r["prompt"],               # First positional - EXACT from generate.py
+                r["image"],                # Second positional - EXACT from generate.py
+                max_area=r["max_area"],    # EXACT from generate.py
+                frame_num=81,              # EXACT default from generate.py (4n+1 format)
+                shift=r["shift"],          # EXACT shift parameter
+                sample_solver=r["sample_solver"],
+                sampling_steps=r["sampling_steps"],
+                guide_scale=5.0,           # EXACT default
+                n_prompt=r["n_prompt"],
+                seed=r["seed"] if r["seed"] >= 0 else -1,        # EXACT logic from generate.py
+                offload_model=offload       # Only offload when VRAM is too small
+            )]
+    
+    return videos
+
+def _get_job_queue():
+    """Return the job queue, starting the batcher inside the running event loop on first use"""
+    global job_queue, batcher_task
+    
+    if job_queue is None:
+        job_queue = asyncio.Queue()
+        batcher_task = asyncio.create_task(batcher())
+    
+    return job_queue
+
+async def batcher():
+    """Collect queued generation requests and run compatible ones as a single batch"""
+    loop = asyncio.get_running_loop()
+    
+    while True:
+        batch = [await job_queue.get()]
+        
+        # Already 1 when offloading, and capped by VRAM otherwise
+        batch_max = model_cache['batch_max']
+        deadline = loop.time() + BATCH_TIMEOUT
+        while len(batch) < batch_max:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(job_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        
+        # Only requests with identical latent shapes can share a DiT forward
+        groups = {}
+        for request in batch:
+            groups.setdefault(request["batch_key"], []).append(request)
+        
+        for group in groups.values():
+            try:
+                videos = await loop.run_in_executor(gpu_executor, generate_videos, group)
+            except Exception as e:
+                for request in group:
+                    if not request["future"].done():
+                        request["future"].set_exception(e)
+            else:
+                for request, video in zip(group, videos):
+                    if not request["future"].done():
+                        request["future"].set_result(video)
+
+def _error_code(e):
+    """Map an exception to the API error_code"""
+    for error_type, code in ERROR_TYPES:
+        if isinstance(e, error_type):
+            return code
+    
+    m = ERROR_PATTERN.search(str(e))
+    return ERROR_CODES[m.group(1).lower()] if m else "GENERATION_ERROR"
+
 async def async_generator_handler(job):
     """RunPod async generator handler for video generation"""
     job_input = job.get("input", {})
@@ -113,6 +984,14 @@ async def async_generator_handler(job):
             }
             return
         
+        if not isinstance(image_url, str) or not isinstance(prompt, str):
+            yield {
+                "error": "Invalid parameters: image_url and prompt must be strings",
+                "error_code": "INVALID_INPUT",
+                "status": "failed"
+            }
+            return
+        
         logger.info(f"Starting video generation job {job_id} with prompt: '{prompt}'")
         
         # Extract optional parameters with defaults
@@ -120,15 +999,28 @@ async def async_generator_handler(job):
         seed = job_input.get("seed", -1)
         resolution = job_input.get("resolution", "720p")
         
+        # Jobs share a batch, so bad inputs must be rejected here rather than fail everyone's batch
+        if not isinstance(negative, str):
+            yield {
+                "error": "Invalid negative: must be a string",
+                "error_code": "INVALID_INPUT",
+                "status": "failed"
+            }
+            return
+        
+        if not isinstance(seed, int) or isinstance(seed, bool) or seed >= 2**63:
+            yield {
+                "error": f"Invalid seed: {seed}. Use an integer below 2**63, or -1 for random",
+                "error_code": "INVALID_INPUT",
+                "status": "failed"
+            }
+            return
+        
         # Map resolution to parameters - EXACT from generate.py logic
-        if resolution == "720p":
-            size_key = "1280*720"
+        if resolution in RESOLUTIONS:
+            size_key = RESOLUTIONS[resolution]["size_key"]
             max_area = MAX_AREA_CONFIGS[size_key]  # Use exact config
-            shift = 8.0
-        elif resolution == "480p":
-            size_key = "832*480"
-            max_area = MAX_AREA_CONFIGS[size_key]  # Use exact config
-            shift = 8.0
+            shift = RESOLUTIONS[resolution]["shift"]
         else:
             yield {
                 "error": f"Unsupported resolution: {resolution}. Use '720p' or '480p'",
@@ -137,6 +1029,25 @@ async def async_generator_handler(job):
             }
             return
         
+        sampling_steps = job_input.get("sampling_steps", DEFAULT_SAMPLING_STEPS)
+        sample_solver = job_input.get("solver", DEFAULT_SOLVER)
+        
+        if not isinstance(sampling_steps, int) or not MIN_SAMPLING_STEPS <= sampling_steps <= MAX_SAMPLING_STEPS:
+            yield {
+                "error": f"Invalid sampling_steps: {sampling_steps}. Use an integer between {MIN_SAMPLING_STEPS} and {MAX_SAMPLING_STEPS}",
+                "error_code": "INVALID_INPUT",
+                "status": "failed"
+            }
+            return
+        
+        if sample_solver not in SAMPLE_SOLVERS:
+            yield {
+                "error": f"Unsupported solver: {sample_solver}. Use 'unipc' or 'dpm++'",
+                "error_code": "INVALID_INPUT",
+                "status": "failed"
+            }
+            return
+        
         # Step 1: Download input image
         yield {
             "status": "downloading",
@@ -145,19 +1056,34 @@ async def async_generator_handler(job):
             "timestamp": time.time() - start_time
         }
         
-        image = download_image(image_url)
+        image, image_bytes = await download_image(image_url, max_area)
         
-        # Step 2: Load model
-        yield {
-            "status": "loading",
-            "progress": 20,
-            "message": "Loading model...",
-            "timestamp": time.time() - start_time
-        }
+        # Seeded requests are deterministic, so a previous upload can be reused
+        cache_key = None
+        if cache_db is not None and seed >= 0:
+            cache_key = _cache_key(image_bytes, prompt, negative, seed, resolution,
+                                   sampling_steps, sample_solver)
+            cached_url = await asyncio.to_thread(cache_lookup, cache_key)
+            if cached_url:
+                processing_time = time.time() - start_time
+                logger.info(f"Job {job_id} served from cache in {processing_time:.2f}s")
+                yield {
+                    "video_url": cached_url,
+                    "duration": 5.0,
+                    "resolution": resolution,
+                    "seed": seed,
+                    "processing_time": round(processing_time, 2),
+                    "cached": True,
+                    "status": "completed",
+                    "message": f"Video served from cache in {processing_time:.2f}s",
+                    "timestamp": processing_time
+                }
+                return
         
-        model, cfg = load_model()
+        # Model is preloaded by init_worker()
+        model, cfg = model_cache['wan_i2v'], model_cache['config']
         
-        # Step 3: Generate video
+        # Step 2: Generate video
         yield {
             "status": "generating",
             "progress": 30,
@@ -165,58 +1091,78 @@ async def async_generator_handler(job):
             "timestamp": time.time() - start_time
         }
         
-        logger.info("Generating video...")
-        # EXACT method call from generate.py
-        video = model.generate(
-            prompt,                    # First positional - EXACT from generate.py
-            image,                     # Second positional - EXACT from generate.py
-            max_area=max_area,         # EXACT from generate.py
-            frame_num=81,              # EXACT default from generate.py (4n+1 format)
-            shift=shift,               # EXACT shift parameter
-            sample_solver='unipc',     # EXACT default from generate.py
-            sampling_steps=40,         # EXACT default for i2v tasks
-            guide_scale=5.0,           # EXACT default
-            n_prompt=negative if negative else cfg.sample_neg_prompt,
-            seed=seed if seed >= 0 else -1,        # EXACT logic from generate.py
-            offload_model=False         # EXACT from generate.py
-        )
-        
-        # Step 4: Save video
-        yield {
-            "status": "saving",
-            "progress": 80,
-            "message": "Saving video...",
-            "timestamp": time.time() - start_time
+        # Hand the job to the batcher and wait for its video
+        latent_size = _latent_size(model, image, max_area)
+        future = asyncio.get_running_loop().create_future()
+        request = {
+            "prompt": prompt,
+            "image": image,
+            "n_prompt": negative if negative else cfg.sample_neg_prompt,
+            "seed": seed,
+            "max_area": max_area,
+            "shift": shift,
+            "resolution": resolution,
+            "latent_size": latent_size,
+            "sampling_steps": sampling_steps,
+            "sample_solver": sample_solver,
+            "batch_key": (resolution, latent_size, sampling_steps, sample_solver),
+            "future": future,
         }
         
+        # Overlap the image H2D copy with whatever batch is currently on the GPU
+        if not model_cache['offload']:
+            request["image_gpu"], request["image_ready"] = await asyncio.to_thread(stage_image, image)
+        
+        await _get_job_queue().put(request)
+        video = await future
+        
         # Generate unique filename
         output_filename = f"wan21_i2v_{uuid.uuid4().hex[:8]}.mp4"
         output_path = f"/tmp/{output_filename}"
+        fps = 18  # Use config fps (16 from gradio examples)
         
-        logger.info(f"Saving video to: {output_path}")
-        # EXACT cache_video call from generate.py
-        cache_video(
-            tensor=video[None],        # EXACT format
-            save_file=output_path,
-            fps=18,        # Use config fps (16 from gradio examples)
-            nrow=1,
-            normalize=True,
-            value_range=(-1, 1)
-        )
+        if STREAM_UPLOAD and _nvenc_available(video):
+            # Step 3+4: NVENC output is uploaded while frames are still being encoded
+            upload_task = asyncio.create_task(upload_video_streaming(video, output_path, fps))
+            message = "Encoding and uploading video..."
+        else:
+            # Step 3: Save video
+            yield {
+                "status": "saving",
+                "progress": 80,
+                "message": "Saving video...",
+                "timestamp": time.time() - start_time
+            }
+            
+            logger.info(f"Saving video to: {output_path}")
+            await save_video(video, output_path, fps)
+            
+            # Step 4: Upload to file.io - started before reporting so it overlaps the yield
+            upload_task = asyncio.create_task(_upload(output_path))
+            message = "Uploading video..."
         
-        # Step 5: Upload to file.io
         yield {
             "status": "uploading",
             "progress": 90,
-            "message": "Uploading video...",
+            "message": message,
             "timestamp": time.time() - start_time
         }
         
-        video_url = _upload(output_path)
+        # Heartbeat while the upload runs in the background
+        while not upload_task.done():
+            await asyncio.wait({upload_task}, timeout=UPLOAD_HEARTBEAT_SECONDS)
+            if not upload_task.done():
+                yield {
+                    "status": "uploading",
+                    "progress": 90,
+                    "message": "Still uploading video...",
+                    "timestamp": time.time() - start_time
+                }
+        
+        video_url = await upload_task
         
-        # Clean up temporary file
-        if os.path.exists(output_path):
-            os.unlink(output_path)
+        if cache_key is not None:
+            await asyncio.to_thread(cache_store, cache_key, video_url)
         
         processing_time = time.time() - start_time
         
@@ -227,6 +1173,7 @@ async def async_generator_handler(job):
             "resolution": resolution,
             "seed": seed,
             "processing_time": round(processing_time, 2),
+            "cached": False,
             "status": "completed",
             "message": f"Video generation completed in {processing_time:.2f}s",
             "timestamp": processing_time
@@ -237,21 +1184,9 @@ async def async_generator_handler(job):
     except Exception as e:
         logger.error(f"Error during video generation for job {job_id}: {str(e)}")
         
-        # Determine error type
-        if "download" in str(e).lower():
-            error_code = "DOWNLOAD_ERROR"
-        elif "model" in str(e).lower():
-            error_code = "MODEL_ERROR"
-        elif "memory" in str(e).lower() or "cuda" in str(e).lower():
-            error_code = "MEMORY_ERROR"
-        elif "upload" in str(e).lower():
-            error_code = "UPLOAD_ERROR"
-        else:
-            error_code = "GENERATION_ERROR"
-        
         yield {
             "error": str(e),
-            "error_code": error_code,
+            "error_code": _error_code(e),
             "status": "failed",
             "processing_time": time.time() - start_time,
             "timestamp": time.time() - start_time
@@ -261,8 +1196,14 @@ async def run_test(job):
     """Test function for local development"""
     async for item in async_generator_handler(job):
         print(json.dumps(item, indent=2))
+    
+    if http_session is not None:
+        await http_session.close()
 
 if __name__ == "__main__":
+    # Load weights up front so the first job doesn't pay the cold start
+    init_worker()
+    
     if "--test_input" in sys.argv:
         test_input_index = sys.argv.index("--test_input")
         if test_input_index + 1 < len(sys.argv):
@@ -278,5 +1219,7 @@ if __name__ == "__main__":
         # Initialize RunPod serverless with async generator
         runpod.serverless.start({
             "handler": async_generator_handler,
+            # Let jobs queue up for batching; when batches are capped at 1, route extras elsewhere
+            "concurrency_modifier": lambda current: model_cache['batch_max'],
             "return_aggregate_stream": True  # Makes results available via /run endpoint
         })